@@ -0,0 +1,49 @@
+import cv2
+import hashlib
+import threading
+import numpy as np
+from dataclasses import dataclass
+
+
+@dataclass
+class AnalysisContext:
+    """
+    A decoded moodboard plus derived arrays shared by all analyzers.
+    Built once per analysis so each color conversion happens a single time.
+    """
+    bgr: np.ndarray
+    gray: np.ndarray
+    scale: float = 1.0  # factor bgr was resized by relative to the source image
+
+    @classmethod
+    def from_bgr(cls, bgr, scale=1.0):
+        return cls(bgr=bgr, gray=cv2.cvtColor(bgr, cv2.COLOR_BGR2GRAY), scale=scale)
+
+
+class ContentCache:
+    """
+    Small FIFO memo for analyzer results, keyed by a BLAKE2b hash of the
+    input array's pixels (plus shape, dtype and any extra arguments).
+    """
+
+    def __init__(self, max_entries=16):
+        self.max_entries = max_entries
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get_or_compute(self, compute, array, *extra):
+        """Return compute(array, *extra), reusing the stored result for identical input."""
+        digest = hashlib.blake2b(repr((array.shape, array.dtype.str) + extra).encode(), digest_size=8)
+        digest.update(np.ascontiguousarray(array))
+        key = digest.digest()
+
+        with self._lock:
+            if key in self._entries:
+                return self._entries[key]
+
+        result = compute(array, *extra)
+        with self._lock:
+            if len(self._entries) >= self.max_entries:
+                del self._entries[next(iter(self._entries))]
+            self._entries[key] = result
+        return result
@@ -1,69 +1,87 @@
 import cv2
 import numpy as np
-from sklearn.cluster import KMeans
-from collections import Counter
-import colorsys
+from analysis_context import ContentCache
+
+_HEX = [f"{i:02x}" for i in range(256)]
 
 class ColorExtractor:
-    def __init__(self, n_colors=8):
+    def __init__(self, n_colors=8, tile_pixels=1 << 18):
         self.n_colors = n_colors
+        self.tile_pixels = tile_pixels
+        self._cache = ContentCache(max_entries=16)
+        # Hue name per whole degree, so naming is a single lookup
+        self._hue_names = np.array(
+            ["Red"] * 30 + ["Yellow"] * 60 + ["Green"] * 60 + ["Cyan"] * 60
+            + ["Blue"] * 60 + ["Magenta"] * 60 + ["Red"] * 30
+        )
 
     def extract_palette(self, image_path):
         image = cv2.imread(str(image_path))
         if image is None:
             raise ValueError("Could not load image")
-            
-        image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-        modified_image = cv2.resize(image, (600, 400), interpolation=cv2.INTER_AREA)
-        modified_image = modified_image.reshape(modified_image.shape[0]*modified_image.shape[1], 3)
+        return self.extract_palette_array(image)
 
-        clf = KMeans(n_clusters=self.n_colors, n_init=10)
-        labels = clf.fit_predict(modified_image)
-        
-        counts = Counter(labels)
-        center_colors = clf.cluster_centers_
-        
-        ordered_colors = [center_colors[i] for i in counts.keys()]
-        ordered_counts = [counts[i] for i in counts.keys()]
-        total_pixels = sum(ordered_counts)
-        
-        sorted_indices = np.argsort(ordered_counts)[::-1]
+    def extract_palette_ctx(self, ctx):
+        # ctx: AnalysisContext; binning works on the BGR pixels directly, so no HSV pass is needed
+        return self.extract_palette_array(ctx.bgr)
+
+    def extract_palette_array(self, image):
+        # Palettes are memoized by pixel content, so re-analyzing the same image is free
+        return self._cache.get_or_compute(self._compute, image)
+
+    def _compute(self, image):
+        # Binning is channel-order agnostic, so stay in BGR and only flip the centers.
+        # The full-resolution image is binned in cache-sized row tiles; per-tile
+        # counts and channel sums merge exactly by addition.
+        bin_counts = np.zeros(32768, dtype=np.int64)
+        bin_sums = np.zeros((3, 32768), dtype=np.float64)
+        rows_per_tile = max(1, self.tile_pixels // image.shape[1])
+        for start in range(0, image.shape[0], rows_per_tile):
+            tile = image[start:start + rows_per_tile].reshape(-1, 3)
+
+            # 5 bits per channel -> 32^3 bins; the most populated bins form the palette
+            q = (tile >> 3).astype(np.uint32)
+            keys = (q[:, 0] << 10) | (q[:, 1] << 5) | q[:, 2]
+            bin_counts += np.bincount(keys, minlength=32768)
+
+            # Mean color per bin: one weighted bincount per channel (D=3)
+            for c in range(3):
+                bin_sums[c] += np.bincount(keys, weights=tile[:, c], minlength=32768)
+
+        n_bins = min(self.n_colors, int(np.count_nonzero(bin_counts)))
+        top = np.argpartition(bin_counts, -n_bins)[-n_bins:]
+
+        # Order the selected bins by population once; everything below is preindexed
+        top = top[np.argsort(-bin_counts[top])]
+        counts_sorted = bin_counts[top]
+        centers_sorted = (bin_sums[:, top].T / counts_sorted[:, None])[:, ::-1]  # BGR -> RGB
+        pcts = np.round(counts_sorted * (100.0 / bin_counts.sum()), 1)
         
-        colors_data = []
-        for i in sorted_indices:
-            rgb = ordered_colors[i].astype(int)
-            hex_code = "#{:02x}{:02x}{:02x}".format(rgb[0], rgb[1], rgb[2])
-            percentage = round((ordered_counts[i] / total_pixels) * 100, 1)
-            
-            # Calculate HSL (colorsys returns 0-1)
-            r, g, b = rgb[0]/255, rgb[1]/255, rgb[2]/255
-            h, l, s = colorsys.rgb_to_hls(r, g, b)
-            
-            # FIX: Return HSL as dictionary with 0-100 scale for S/L
-            hsl_dict = {
-                'h': int(h * 360),
-                's': int(s * 100),
-                'l': int(l * 100)
-            }
-            
-            if l > 0.90: role = "Background"
-            elif l < 0.10: role = "Text/Dark"
-            elif s > 0.5: role = "Accent"
-            else: role = "Secondary"
-            
-            name = self._get_color_name(h, l, s)
+        # Palette columns (SoA): HSL, roles and names for all K colors in one vectorized pass
+        rgbs = centers_sorted.astype(np.uint8)
+        h, l, s = self._rgb_to_hls(rgbs / 255.0)
+        hues, sats, lights = (h * 360).astype(int), (s * 100).astype(int), (l * 100).astype(int)
+        hexes = np.array(["#" + _HEX[r] + _HEX[g] + _HEX[b] for r, g, b in rgbs.tolist()], dtype='U7')
+        roles = np.select([l > 0.90, l < 0.10, s > 0.5], ["Background", "Text/Dark", "Accent"], "Secondary")
+        names = self._get_color_names(h, l, s)
+        if roles.size:
+            roles[0] = 'Primary'
 
-            colors_data.append({
+        # Only the final per-color dict packing happens in Python
+        colors_data = [
+            {
                 "name": name,
                 "hex": hex_code,
-                "rgb": list(rgb),
-                "hsl": hsl_dict, # <--- Dictionary, not list
+                "rgb": rgb,
+                "hsl": {'h': hue, 's': sat, 'l': light}, # 0-360 hue, 0-100 S/L
                 "percentage": percentage,
                 "role": role
-            })
-
-        if colors_data:
-            colors_data[0]['role'] = 'Primary'
+            }
+            for name, hex_code, rgb, hue, sat, light, percentage, role in zip(
+                names.tolist(), hexes.tolist(), rgbs.tolist(), hues.tolist(),
+                sats.tolist(), lights.tolist(), pcts.tolist(), roles.tolist()
+            )
+        ]
             
         return {
             "colors": colors_data,
@@ -77,34 +95,36 @@ class ColorExtractor:
     def generate_design_tokens(self, palette_data):
         colors_list = palette_data['colors'] if isinstance(palette_data, dict) else palette_data
             
-        tokens = {}
-        for i, color in enumerate(colors_list):
-            role_key = color.get('role', 'secondary').lower().replace('/', '-')
-            key = f"color-{role_key}-{i+1}"
-            tokens[key] = {
+        return {
+            f"color-{color.get('role', 'secondary').lower().replace('/', '-')}-{i}": {
                 "value": color['hex'],
                 "type": "color",
                 "comment": f"{color.get('name', 'Color')} - {color.get('percentage', 0)}% coverage"
             }
-        return tokens
+            for i, color in enumerate(colors_list, 1)
+        }
 
     def export_css_variables(self, tokens):
         # Generate CSS block
-        css = ":root {\n"
-        for name, token in tokens.items():
-            css += f"  --{name}: {token['value']};\n"
-        css += "}"
-        return css
-
-    def _get_color_name(self, h, l, s):
-        if l < 0.1: return "Black"
-        if l > 0.9: return "White"
-        if s < 0.1: return "Gray"
-        hue_deg = h * 360
-        if hue_deg < 30: return "Red"
-        if hue_deg < 90: return "Yellow"
-        if hue_deg < 150: return "Green"
-        if hue_deg < 210: return "Cyan"
-        if hue_deg < 270: return "Blue"
-        if hue_deg < 330: return "Magenta"
-        return "Red"
\ No newline at end of file
+        lines = "\n".join(f"  --{name}: {token['value']};" for name, token in tokens.items())
+        return ":root {\n" + lines + "\n}" if lines else ":root {\n}"
+
+    def _rgb_to_hls(self, rgb):
+        """Vectorized colorsys.rgb_to_hls over a [K, 3] array of 0-1 floats."""
+        maxc = rgb.max(axis=1)
+        minc = rgb.min(axis=1)
+        delta = maxc - minc
+        l = (maxc + minc) / 2.0
+
+        chromatic = delta > 0
+        denom = np.where(l <= 0.5, maxc + minc, 2.0 - maxc - minc)
+        s = np.divide(delta, denom, out=np.zeros_like(delta), where=chromatic)
+
+        rc, gc, bc = np.divide(maxc - rgb.T, delta, out=np.zeros_like(rgb.T), where=chromatic)
+        h = np.select([rgb[:, 0] == maxc, rgb[:, 1] == maxc], [bc - gc, 2.0 + rc - bc], 4.0 + gc - rc)
+        h = np.where(chromatic, (h / 6.0) % 1.0, 0.0)
+        return h, l, s
+
+    def _get_color_names(self, h, l, s):
+        hue_names = self._hue_names[(h * 360).astype(int) % 360]
+        return np.select([l < 0.1, l > 0.9, s < 0.1], ["Black", "White", "Gray"], hue_names)
@@ -1,9 +1,13 @@
+import io
 import os
 from pathlib import Path
 from PIL import Image
-import torch
 from datetime import datetime, timedelta
 import hashlib
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 class ImageUploadHandler:
     """
@@ -26,19 +30,35 @@ class ImageUploadHandler:
         
         # Metadata tracking for 30-day deletion
         self.metadata_file = self.upload_dir / "upload_metadata.json"
+        self._lock = threading.Lock()  # guards _metadata and the on-disk swap
         self._init_metadata()
     
     def _init_metadata(self):
-        """Initialize or load metadata tracking file."""
+        """Initialize or load metadata tracking file into memory."""
         import json
-        if not self.metadata_file.exists():
-            with open(self.metadata_file, 'w') as f:
-                json.dump({}, f)
+        if self.metadata_file.exists():
+            with open(self.metadata_file, 'r') as f:
+                self._metadata = json.load(f)
+        else:
+            self._metadata = {}
+            self.flush_metadata()
     
-    def _generate_safe_filename(self, original_name):
-        """Generate a unique, safe filename."""
+    def flush_metadata(self):
+        """Write in-memory metadata to disk via an atomic tmpfile swap."""
+        import json
+        with self._lock:
+            # Unique tmpfile per write so concurrent handlers never share one
+            with tempfile.NamedTemporaryFile('w', dir=self.upload_dir, prefix=self.metadata_file.name + ".",
+                                             suffix=".tmp", delete=False) as f:
+                tmp_path = f.name
+                json.dump(self._metadata, f, indent=2)
+            os.replace(tmp_path, self.metadata_file)
+    
+    def _generate_safe_filename(self, original_name, content=None):
+        """Generate a unique, safe filename (hashing content when it is given)."""
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        hash_suffix = hashlib.md5(original_name.encode()).hexdigest()[:8]
+        hash_input = original_name.encode() if content is None else content
+        hash_suffix = hashlib.blake2b(hash_input, digest_size=4).hexdigest()
         ext = Path(original_name).suffix.lower()
         return f"moodboard_{timestamp}_{hash_suffix}{ext}"
     
@@ -47,63 +67,101 @@ class ImageUploadHandler:
         Validate uploaded image meets requirements.
         
         Returns:
-            tuple: (is_valid, error_message)
+            tuple: (is_valid, error_message, image_info) where image_info is
+                (width, height, format) for valid images and None otherwise
         """
         file_path = Path(file_path)
         
         # Check file exists
         if not file_path.exists():
-            return False, "File does not exist"
+            return False, "File does not exist", None
         
         # Check file size
         if file_path.stat().st_size > self.max_size_bytes:
-            return False, f"File exceeds {self.max_size_bytes / (1024*1024):.1f}MB limit"
+            return False, f"File exceeds {self.max_size_bytes / (1024*1024):.1f}MB limit", None
         
         # Check file format
         if file_path.suffix.lower() not in self.allowed_formats:
-            return False, f"Format must be one of: {', '.join(self.allowed_formats)}"
+            return False, f"Format must be one of: {', '.join(self.allowed_formats)}", None
         
         # Try to open with PIL to verify it's a valid image
         try:
+            # Size and format come from the header, so grab them before verify()
             with Image.open(file_path) as img:
+                width, height = img.size
+                format_type = img.format
                 img.verify()
-            return True, "Valid image"
+            return True, "Valid image", (width, height, format_type)
         except Exception as e:
-            return False, f"Invalid or corrupted image: {str(e)}"
+            return False, f"Invalid or corrupted image: {str(e)}", None
     
-    def process_upload(self, source_path, user_id=None):
+    def process_upload(self, source_path, user_id=None, flush=True):
         """
         Process an uploaded image with privacy safeguards.
         
         Args:
             source_path: Path to the uploaded file
             user_id: Optional user identifier for multi-user systems
+            flush: Write metadata to disk now; batch callers can pass False
+                and call flush_metadata() once at the end
             
         Returns:
             dict: Upload result with file_id and metadata
         """
-        import json
-        import shutil
-        
         # Validate the image
-        is_valid, message = self.validate_image(source_path)
+        is_valid, message, image_info = self.validate_image(source_path)
         if not is_valid:
             return {"success": False, "error": message}
         
-        # Generate safe filename and copy to upload directory
+        # Generate safe filename and write a metadata-free copy to the upload directory
         safe_name = self._generate_safe_filename(Path(source_path).name)
         dest_path = self.upload_dir / safe_name
-        shutil.copy2(source_path, dest_path)
+        self._strip_metadata(source_path, dest_path)
+        
+        # Basic image info was read during validation
+        width, height, format_type = image_info
+        
+        return self._record_upload(
+            safe_name, dest_path, width, height, format_type,
+            Path(source_path).name, user_id, flush
+        )
+    
+    def process_upload_pil(self, pil_image, user_id=None, original_name="upload.png", flush=True):
+        """
+        Process an in-memory PIL image (e.g. from Gradio) without a temp file.
+        
+        The image is encoded to PNG once in memory, without EXIF or text
+        chunks, and written directly to the upload directory.
+        
+        Args:
+            pil_image: PIL.Image to store
+            user_id: Optional user identifier for multi-user systems
+            original_name: Name recorded in metadata
+            flush: Write metadata to disk now; batch callers can pass False
+                and call flush_metadata() once at the end
+            
+        Returns:
+            dict: Upload result with file_id and metadata
+        """
+        buffer = io.BytesIO()
+        try:
+            pil_image.save(buffer, format="PNG", optimize=False, exif=b"")
+        except Exception as e:
+            return {"success": False, "error": f"Invalid or corrupted image: {str(e)}"}
         
-        # Remove EXIF data for privacy (strip metadata)
-        self._strip_metadata(dest_path)
+        data = buffer.getbuffer()
+        if data.nbytes > self.max_size_bytes:
+            return {"success": False, "error": f"File exceeds {self.max_size_bytes / (1024*1024):.1f}MB limit"}
         
-        # Get basic image info
-        with Image.open(dest_path) as img:
-            width, height = img.size
-            format_type = img.format
+        safe_name = self._generate_safe_filename(original_name, content=data)
+        dest_path = self.upload_dir / safe_name
+        dest_path.write_bytes(data)
         
-        # Record metadata with deletion date
+        width, height = pil_image.size
+        return self._record_upload(safe_name, dest_path, width, height, "PNG", original_name, user_id, flush)
+    
+    def _record_upload(self, safe_name, dest_path, width, height, format_type, original_name, user_id, flush):
+        """Record metadata with a 30-day deletion date and build the upload result."""
         upload_time = datetime.now()
         deletion_date = upload_time + timedelta(days=30)
         
@@ -111,21 +169,19 @@ class ImageUploadHandler:
             "file_id": safe_name,
             "upload_time": upload_time.isoformat(),
             "deletion_date": deletion_date.isoformat(),
+            "deletion_ts": int(deletion_date.timestamp()),
             "user_id": user_id,
             "width": width,
             "height": height,
             "format": format_type,
-            "original_name": Path(source_path).name
+            "original_name": original_name
         }
         
         # Save metadata
-        with open(self.metadata_file, 'r') as f:
-            all_metadata = json.load(f)
-        
-        all_metadata[safe_name] = metadata
-        
-        with open(self.metadata_file, 'w') as f:
-            json.dump(all_metadata, f, indent=2)
+        with self._lock:
+            self._metadata[safe_name] = metadata
+        if flush:
+            self.flush_metadata()
         
         return {
             "success": True,
@@ -136,58 +192,72 @@ class ImageUploadHandler:
             "format": format_type
         }
     
-    def _strip_metadata(self, image_path):
+    def _strip_metadata(self, image_path, dest_path=None):
         """
         Remove EXIF and other metadata from image for privacy.
         Keeps only essential image data.
+        
+        Args:
+            image_path: Image to read
+            dest_path: Where to write the stripped image (defaults to in place)
         """
+        dest_path = image_path if dest_path is None else dest_path
         try:
-            img = Image.open(image_path)
-            
-            # Create new image without EXIF data
-            data = list(img.getdata())
-            image_without_exif = Image.new(img.mode, img.size)
-            image_without_exif.putdata(data)
-            
-            # Save back to same path
-            image_without_exif.save(image_path)
+            with Image.open(image_path) as img:
+                img.load()
+                
+                # Re-encode without EXIF/ICC/text chunks instead of copying pixels through Python
+                img.info.clear()
+                img.save(dest_path, format=img.format, exif=b"")
             
         except Exception as e:
             print(f"Warning: Could not strip metadata: {e}")
+            if not Path(dest_path).exists():
+                import shutil
+                shutil.copy2(image_path, dest_path)
     
     def cleanup_expired(self):
         """
         Remove images past their 30-day retention period.
         Should be run periodically (daily cron job recommended).
         """
-        import json
+        now_ts = int(time.time())
+        with self._lock:
+            expired = [
+                file_id for file_id, metadata in self._metadata.items()
+                if self._deletion_ts(metadata) <= now_ts
+            ]
         
-        with open(self.metadata_file, 'r') as f:
-            all_metadata = json.load(f)
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            removed = list(executor.map(self._remove_file, expired))
+        deleted_files = [file_id for file_id, ok in zip(expired, removed) if ok]
         
-        now = datetime.now()
-        deleted_files = []
-        
-        for file_id, metadata in list(all_metadata.items()):
-            deletion_date = datetime.fromisoformat(metadata['deletion_date'])
-            
-            if now >= deletion_date:
-                file_path = self.upload_dir / file_id
-                if file_path.exists():
-                    file_path.unlink()
-                    deleted_files.append(file_id)
-                
-                del all_metadata[file_id]
+        with self._lock:
+            for file_id in expired:
+                self._metadata.pop(file_id, None)
         
         # Save updated metadata
-        with open(self.metadata_file, 'w') as f:
-            json.dump(all_metadata, f, indent=2)
+        self.flush_metadata()
         
         return {
             "deleted_count": len(deleted_files),
             "deleted_files": deleted_files
         }
     
+    def _deletion_ts(self, metadata):
+        """Deletion time as a Unix timestamp (older entries only store the ISO date)."""
+        if 'deletion_ts' in metadata:
+            return metadata['deletion_ts']
+        return datetime.fromisoformat(metadata['deletion_date']).timestamp()
+    
+    def _remove_file(self, file_id):
+        """Delete a stored upload; returns False if it was already gone."""
+        try:
+            (self.upload_dir / file_id).unlink()
+            return True
+        except FileNotFoundError:
+            return False
+    
     def get_image_for_processing(self, file_id):
         """
         Load image for AI processing.
@@ -227,13 +297,13 @@ def create_upload_interface():
         with output:
             output.clear_output()
             
-            # Get uploaded file
-            uploaded_file = list(uploader.value.values())[0]
+            # Get uploaded file (ipywidgets 8 uses a tuple, older versions a dict)
+            value = uploader.value
+            uploaded_file = next(iter(value.values() if isinstance(value, dict) else value))
             
             # Save temporarily
             temp_path = Path("./temp_upload.jpg")
-            with open(temp_path, 'wb') as f:
-                f.write(uploaded_file['content'])
+            temp_path.write_bytes(uploaded_file['content'])
             
             # Process upload
             result = handler.process_upload(temp_path)
@@ -1,36 +1,61 @@
 import cv2
 import numpy as np
+from analysis_context import ContentCache
 
 class PatternRecognizer:
-    def __init__(self):
-        pass
+    def __init__(self, max_side=1024):
+        self.max_side = max_side
+        self._cache = ContentCache(max_entries=16)
 
     def analyze_patterns(self, image_path):
         image = cv2.imread(str(image_path))
         if image is None: return self._default_patterns()
+        return self.analyze_patterns_array(image)
+
+    def analyze_patterns_array(self, image, scale=1.0):
+        # BGR array already resized by scale; results are reported in source pixels
+        return self._analyze_gray(cv2.cvtColor(image, cv2.COLOR_BGR2GRAY), scale)
+
+    def analyze_patterns_ctx(self, ctx):
+        return self._analyze_gray(ctx.gray, ctx.scale)
+
+    def _analyze_gray(self, gray, scale):
+        return self._cache.get_or_compute(self._compute, gray, scale)
+
+    def _compute(self, gray, scale):
+        # Edge/contour work is done on a bounded analysis size; spacing is scaled back after
+        h, w = gray.shape[:2]
+        resize = min(1.0, self.max_side / max(h, w))
+        if resize < 1.0:
+            # Explicit dsize: fx/fy alone would round a very thin side down to 0
+            dsize = (max(1, round(w * resize)), max(1, round(h * resize)))
+            gray = cv2.resize(gray, dsize, interpolation=cv2.INTER_AREA)
+        scale *= resize
 
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
         edges = cv2.Canny(gray, 50, 150)
-        contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        
-        rects = [cv2.boundingRect(c) for c in contours if cv2.contourArea(c) > 100]
-        
-        spacings = []
-        rects.sort(key=lambda x: x[0])
-        for i in range(len(rects) - 1):
-            gap = rects[i+1][0] - (rects[i][0] + rects[i][2])
-            if gap > 0: spacings.append(gap)
+
+        # One C call yields bounding boxes and areas for every edge component
+        _, _, stats, _ = cv2.connectedComponentsWithStats((edges > 0).astype(np.uint8), connectivity=8)
+        rects_arr = stats[1:, [cv2.CC_STAT_LEFT, cv2.CC_STAT_TOP, cv2.CC_STAT_WIDTH, cv2.CC_STAT_HEIGHT]]
+        rects_arr = rects_arr[stats[1:, cv2.CC_STAT_AREA] > 100 * scale]
+        rects_arr = rects_arr[rects_arr[:, 0].argsort()]
+        gaps = rects_arr[1:, 0] - (rects_arr[:-1, 0] + rects_arr[:-1, 2])
+        spacings = gaps[gaps > 0]
                 
         base_unit = 8
-        if spacings:
-            hist = np.histogram(spacings, bins=range(0, 100, 4))
-            if hist[1][np.argmax(hist[0])] > 0:
-                base_unit = int(hist[1][np.argmax(hist[0])])
+        # Bin in source pixels so the 4px grid and 100px cutoff don't depend on the resize
+        sp = np.rint(spacings / scale).astype(np.int64)
+        sp = sp[sp < 100]
+        if sp.size:
+            # Gaps are small non-negative ints, so 4px bins are just sp // 4
+            mode_bin = np.bincount(sp // 4).argmax()
+            if mode_bin > 0:
+                base_unit = int(mode_bin * 4)
 
         cols = 12
-        if len(rects) > 2:
-            avg_width = np.mean([r[2] for r in rects])
-            cols = max(1, min(12, int(image.shape[1] / (avg_width + base_unit))))
+        if len(rects_arr) > 2:
+            avg_width = rects_arr[:, 2].mean() / scale
+            cols = max(1, min(12, int(gray.shape[1] / scale / (avg_width + base_unit))))
 
         return {
             "spacing": {
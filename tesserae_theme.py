@@ -83,6 +83,50 @@ h1 {
     padding: 16px;
 }
 
+/* Individual color swatch cards; only the background is set inline */
+.tess-swatch {
+    color: #000000;
+    padding: 16px;
+    border-radius: 12px;
+    display: flex;
+    flex-direction: column;
+    justify-content: space-between;
+    height: 100px;
+    box-shadow: 0 4px 6px -1px rgba(0,0,0,0.05);
+    border: none;
+    transition: transform 0.2s;
+}
+
+.tess-swatch:hover {
+    transform: translateY(-2px);
+}
+
+/* Very light swatches need an outline to stand out from the page */
+.tess-swatch--light {
+    border: 1px solid rgba(0,0,0,0.1);
+}
+
+/* Dark swatches switch to white text for contrast */
+.tess-swatch--dark {
+    color: #ffffff;
+}
+
+.tess-swatch__hex {
+    font-weight: 700;
+    font-family: monospace;
+    font-size: 1.1em;
+}
+
+.tess-swatch__name {
+    font-size: 0.85em;
+    font-weight: 500;
+}
+
+.tess-swatch__pct {
+    font-size: 0.75em;
+    opacity: 0.8;
+}
+
 /* Markdown headers inside analysis */
 .prose h2 {
     font-weight: 700;
@@ -8,27 +8,103 @@ Full design system extraction:
 - Complete design token generation
 """
 
+import asyncio
+import os
 import gradio as gr
-from pathlib import Path
-from PIL import Image
 import json
+import hashlib
+import tempfile
+import time
 from image_upload import ImageUploadHandler
-from color_extraction import ColorExtractor
-from pattern_recognition import PatternRecognizer
-from typography_analysis import TypographyAnalyzer
 import tesserae_theme  # <--- Add this line
 
+try:
+    import orjson  # optional: much faster token serialization
+except ImportError:
+    orjson = None
+
+# Longest side (px) images are downscaled to before analysis
+ANALYSIS_MAX_SIDE = 1024
+
+# Swatch card markup; static styling lives in the .tess-swatch classes of tesserae_theme.custom_css
+_SWATCH_TEMPLATE = (
+    '<div class="tess-swatch{modifiers}" style="background-color: {hex};">'
+    '<div class="tess-swatch__hex">{hex}</div>'
+    '<div><div class="tess-swatch__name">{name}</div>'
+    '<div class="tess-swatch__pct">{percentage}%</div></div>'
+    '</div>'
+).format
+
+# Analysis results keyed by a BLAKE2b hash of the decoded image, shared across sessions
+_RESULTS_CACHE = {}
+_RESULTS_CACHE_SIZE = 32
+
+# Analyzers pull in OpenCV/NumPy, so they are created on first use rather than at start-up
+_ANALYZERS = None
+
+
+def _load_analyzers():
+    """Import and create the color, pattern and typography analyzers once."""
+    global _ANALYZERS
+    if _ANALYZERS is None:
+        from color_extraction import ColorExtractor
+        from pattern_recognition import PatternRecognizer
+        from typography_analysis import TypographyAnalyzer
+        _ANALYZERS = (ColorExtractor(n_colors=8), PatternRecognizer(), TypographyAnalyzer())
+    return _ANALYZERS
+
+
+def _prepare_image(image):
+    """Decode a PIL image to BGR, hash its pixels and downscale it for analysis.
+
+    Returns (cache_key, bgr, scale). Runs on a worker thread, off the event loop.
+    """
+    # OpenCV/NumPy are only imported once an analysis is actually requested
+    import numpy as np
+    import cv2
+    img = np.ascontiguousarray(np.asarray(image.convert("RGB"))[:, :, ::-1])
+    
+    # Re-analyzing identical pixels (e.g. a second Analyze click) reuses earlier results
+    digest = hashlib.blake2b(str(img.shape).encode(), digest_size=16)
+    digest.update(img)
+    
+    # Every analyzer only needs coarse statistics, so cap the working size once
+    h, w = img.shape[:2]
+    scale = min(1.0, ANALYSIS_MAX_SIDE / max(h, w))
+    if scale < 1.0:
+        # Explicit dsize: fx/fy alone would round a very thin side down to 0
+        img = cv2.resize(img, (max(1, round(w * scale)), max(1, round(h * scale))), interpolation=cv2.INTER_AREA)
+    return digest.hexdigest(), img, scale
+
+
+# Exported files only need to outlive Gradio copying them into its own cache
+_EXPORT_DIR = None
+_EXPORT_TTL = 300
+
+
+def _new_export_file(mode, suffix):
+    """Open a fresh export file, first removing earlier exports Gradio has already cached."""
+    global _EXPORT_DIR
+    if _EXPORT_DIR is None:
+        _EXPORT_DIR = tempfile.TemporaryDirectory(prefix="tesserae_exports_")  # removed at exit
+    cutoff = time.time() - _EXPORT_TTL
+    for entry in os.scandir(_EXPORT_DIR.name):
+        try:
+            if entry.stat().st_mtime < cutoff:
+                os.unlink(entry.path)
+        except FileNotFoundError:
+            pass
+    return tempfile.NamedTemporaryFile(mode, suffix=suffix, prefix='tesserae_tokens_',
+                                       dir=_EXPORT_DIR.name, delete=False)
+
 
 def create_tesserae_interface():
     """Create complete Tesserae interface with all features."""
     
     handler = ImageUploadHandler()
-    color_extractor = ColorExtractor(n_colors=8)
-    pattern_recognizer = PatternRecognizer()
-    typography_analyzer = TypographyAnalyzer()
     
-    # Store results for export
-    current_results = {
+    # Per-session results for export (held in gr.State, so concurrent sessions never mix)
+    empty_results = {
         'palette': None,
         'patterns': None,
         'typography': None,
@@ -38,48 +114,57 @@ def create_tesserae_interface():
         'file_id': None
     }
     
-    def process_moodboard(image, user_consent):
+    async def process_moodboard(image, user_consent, current_results):
         """Process uploaded moodboard with complete analysis."""
         if not user_consent:
             return (
                 "❌ Please review and accept the privacy policy before uploading.",
-                None, "", "", "", "", "", None
+                None, "", "", "", "", "", None, current_results
             )
         
         if image is None:
-            return "❌ Please upload an image first.", None, "", "", "", "", "", None
+            return "❌ Please upload an image first.", None, "", "", "", "", "", None, current_results
         
         try:
-            # Save temporary file
-            temp_path = Path("./temp_gradio_upload.png")
-            image.save(temp_path)
-            
-            # Process upload
-            result = handler.process_upload(temp_path, user_id="gradio_test_user")
-            temp_path.unlink()
+            # Process upload straight from memory (no temporary PNG on disk)
+            result = await asyncio.to_thread(handler.process_upload_pil, image, user_id="gradio_test_user")
             
             if not result['success']:
-                return f"❌ Upload failed: {result['error']}", None, "", "", "", "", "", None
+                return f"❌ Upload failed: {result['error']}", None, "", "", "", "", "", None, current_results
             
-            file_path = Path(result['path'])
-            processed_img = handler.get_image_for_processing(result['file_id'])
+            from analysis_context import AnalysisContext
+            color_extractor, pattern_recognizer, typography_analyzer = _load_analyzers()
             
-            # Extract colors
-            print("🎨 Extracting colors...")
-            palette = color_extractor.extract_palette(str(file_path))
-            color_tokens = color_extractor.generate_design_tokens(palette)
+            # Decode once to a BGR array shared by all analyzers (no re-reads from disk).
+            # The stored copy is pixel-identical, so the in-memory image is displayed too.
+            processed_img = image
+            cache_key, img, scale = await asyncio.to_thread(_prepare_image, image)
+            cached = _RESULTS_CACHE.get(cache_key)
             
-            # Recognize patterns
-            print("🔍 Recognizing patterns...")
-            patterns = pattern_recognizer.analyze_patterns(str(file_path))
-            pattern_tokens = pattern_recognizer.generate_design_tokens(patterns)
+            if cached is None:
+                # Color, pattern and typography analysis are independent CPU-bound
+                # OpenCV/NumPy passes, so run them side by side on worker threads
+                print("🎨 Extracting colors, 🔍 recognizing patterns, 🔤 analyzing typography...")
+                ctx = await asyncio.to_thread(AnalysisContext.from_bgr, img, scale)
+                palette, patterns, typography = await asyncio.gather(
+                    asyncio.to_thread(color_extractor.extract_palette_ctx, ctx),
+                    asyncio.to_thread(pattern_recognizer.analyze_patterns_ctx, ctx),
+                    asyncio.to_thread(typography_analyzer.analyze_typography_ctx, ctx)
+                )
+                color_tokens = color_extractor.generate_design_tokens(palette)
+                pattern_tokens = pattern_recognizer.generate_design_tokens(patterns)
+                typography_tokens = typography_analyzer.generate_design_tokens(typography)
+                swatches_html = create_color_swatches(palette['colors'])
+                
+                cached = (palette, patterns, typography, color_tokens, pattern_tokens, typography_tokens, swatches_html)
+                if len(_RESULTS_CACHE) >= _RESULTS_CACHE_SIZE:
+                    del _RESULTS_CACHE[next(iter(_RESULTS_CACHE))]  # FIFO eviction
+                _RESULTS_CACHE[cache_key] = cached
             
-            # Analyze typography
-            print("🔤 Analyzing typography...")
-            typography = typography_analyzer.analyze_typography(str(file_path))
-            typography_tokens = typography_analyzer.generate_design_tokens(typography)
+            palette, patterns, typography, color_tokens, pattern_tokens, typography_tokens, swatches_html = cached
             
             # Store for export
+            current_results = dict(current_results)
             current_results['palette'] = palette
             current_results['patterns'] = patterns
             current_results['typography'] = typography
@@ -99,39 +184,41 @@ def create_tesserae_interface():
             """
             
             # Format color palette
-            color_display = "## 🎨 Color Palette\n\n"
+            color_parts = ["## 🎨 Color Palette\n\n"]
             for i, color in enumerate(palette['colors'][:5], 1):
-                color_display += f"**{i}. {color['name'].title()}**  \n"
-                color_display += f"• Hex: `{color['hex']}` • Coverage: {color['percentage']}% • Role: `{color['role']}`  \n\n"
+                color_parts.append(f"**{i}. {color['name'].title()}**  \n")
+                color_parts.append(f"• Hex: `{color['hex']}` • Coverage: {color['percentage']}% • Role: `{color['role']}`  \n\n")
+            color_display = "".join(color_parts)
             
             # Format patterns
-            patterns_display = "## 📐 Spacing & Layout\n\n"
-            patterns_display += "**Spacing Scale:**  \n"
+            pattern_parts = ["## 📐 Spacing & Layout\n\n", "**Spacing Scale:**  \n"]
             spacing_scale = patterns['spacing']['spacing_scale']
             for size, value in list(spacing_scale.items())[:4]:
-                patterns_display += f"• **{size}**: {value}px  \n"
+                pattern_parts.append(f"• **{size}**: {value}px  \n")
             
-            patterns_display += f"\n**Grid:** {patterns['grid']['columns']} columns, {patterns['grid']['gutter']}px gutter  \n"
+            pattern_parts.append(f"\n**Grid:** {patterns['grid']['columns']} columns, {patterns['grid']['gutter']}px gutter  \n")
+            patterns_display = "".join(pattern_parts)
             
             # Format typography
-            typography_display = "## 🔤 Typography\n\n"
+            typography_parts = ["## 🔤 Typography\n\n"]
             
             if typography['text_detected']:
-                typography_display += f"**Text regions detected:** {typography['text_regions']}  \n\n"
+                typography_parts.append(f"**Text regions detected:** {typography['text_regions']}  \n\n")
                 
-                typography_display += "**Suggested Font Pairings:**\n\n"
+                typography_parts.append("**Suggested Font Pairings:**\n\n")
                 for pairing in typography['font_pairings'][:2]:
-                    typography_display += f"**{pairing['name']}**  \n"
-                    typography_display += f"• Heading: {pairing['heading']}  \n"
-                    typography_display += f"• Body: {pairing['body']}  \n"
-                    typography_display += f"• Use: {pairing['use_case']}  \n\n"
+                    typography_parts.append(f"**{pairing['name']}**  \n")
+                    typography_parts.append(f"• Heading: {pairing['heading']}  \n")
+                    typography_parts.append(f"• Body: {pairing['body']}  \n")
+                    typography_parts.append(f"• Use: {pairing['use_case']}  \n\n")
             else:
-                typography_display += "*No text detected in image*  \n"
-                typography_display += "Using recommended typography system  \n\n"
+                typography_parts.append("*No text detected in image*  \n")
+                typography_parts.append("Using recommended typography system  \n\n")
                 
-                typography_display += "**Recommended Fonts:**\n"
+                typography_parts.append("**Recommended Fonts:**\n")
                 for role, data in typography['font_suggestions'].items():
-                    typography_display += f"• **{role.title()}**: {', '.join(data['fonts'][:2])}  \n"
+                    typography_parts.append(f"• **{role.title()}**: {', '.join(data['fonts'][:2])}  \n")
+            typography_display = "".join(typography_parts)
             
             # Format complete analysis
             analysis = palette['analysis']
@@ -154,9 +241,6 @@ def create_tesserae_interface():
 - Text regions: {typography['text_regions']}
 """
             
-            # Create color swatches
-            swatches_html = create_color_swatches(palette['colors'])
-            
             status = f"✅ Complete analysis! Extracted colors, patterns, and typography from your moodboard."
             
             return (
@@ -167,108 +251,92 @@ def create_tesserae_interface():
                 patterns_display,
                 typography_display,
                 analysis_display,
-                swatches_html
+                swatches_html,
+                current_results
             )
                 
         except Exception as e:
             import traceback
             error_details = traceback.format_exc()
             print(f"Error: {error_details}")
-            return f"❌ Error: {str(e)}", None, "", "", "", "", "", None
+            return f"❌ Error: {str(e)}", None, "", "", "", "", "", None, current_results
     
     def create_color_swatches(colors):
         """Create HTML color swatches with improved styling."""
-        # Use the CSS class 'swatch-container' defined in tesserae_theme.py
-        html = '<div class="swatch-container">'
+        # Use the CSS classes 'swatch-container' and 'tess-swatch' defined in tesserae_theme.py
+        parts = ['<div class="swatch-container">']
         
         for color in colors[:8]:
-            hex_color = color['hex']
-            name = color['name']
-            percentage = color['percentage']
-            # Determine text color for contrast
-            text_color = '#000000' if color['hsl']['l'] > 50 else '#ffffff'
-            border = '1px solid rgba(0,0,0,0.1)' if color['hsl']['l'] > 90 else 'none'
-            
-            html += f'''
-            <div style="
-                background-color: {hex_color};
-                color: {text_color};
-                padding: 16px;
-                border-radius: 12px;
-                display: flex;
-                flex-direction: column;
-                justify-content: space-between;
-                height: 100px;
-                box-shadow: 0 4px 6px -1px rgba(0,0,0,0.05);
-                border: {border};
-                transition: transform 0.2s;
-            " onmouseover="this.style.transform='translateY(-2px)'" onmouseout="this.style.transform='translateY(0)'">
-                <div style="font-weight: 700; font-family: monospace; font-size: 1.1em;">{hex_color}</div>
-                <div>
-                    <div style="font-size: 0.85em; font-weight: 500;">{name}</div>
-                    <div style="font-size: 0.75em; opacity: 0.8;">{percentage}%</div>
-                </div>
-            </div>
-            '''
+            # Light swatches get an outline, dark ones white text (see tesserae_theme.py)
+            lightness = color['hsl']['l']
+            if lightness > 90:
+                modifiers = ' tess-swatch--light'
+            elif lightness <= 50:
+                modifiers = ' tess-swatch--dark'
+            else:
+                modifiers = ''
+            parts.append(_SWATCH_TEMPLATE(
+                modifiers=modifiers,
+                hex=color['hex'],
+                name=color['name'],
+                percentage=color['percentage']
+            ))
         
-        html += '</div>'
-        return html
+        parts.append('</div>')
+        return "".join(parts)
     
-    def export_tokens_json():
-        """Export complete design tokens as JSON."""
+    def export_tokens_json(current_results):
+        """Export complete design tokens as a downloadable JSON file."""
         if current_results['color_tokens'] is None:
-            return "❌ No tokens to export. Process an image first."
+            raise gr.Error("No tokens to export. Process an image first.")
         
-        # Combine all tokens
+        # Group the flat per-analyzer token dicts by category
+        pattern_tokens = current_results['pattern_tokens']
         complete_tokens = {
-            'color': current_results['color_tokens']['color'],
-            'spacing': current_results['pattern_tokens']['spacing'],
-            'sizing': current_results['pattern_tokens']['sizing'],
-            'borderRadius': current_results['pattern_tokens']['borderRadius'],
-            'boxShadow': current_results['pattern_tokens']['boxShadow'],
-            'grid': current_results['pattern_tokens']['grid'],
-            'typography': {
-                'fontFamily': current_results['typography_tokens']['fontFamily'],
-                'fontSize': current_results['typography_tokens']['fontSize'],
-                'fontWeight': current_results['typography_tokens']['fontWeight'],
-                'lineHeight': current_results['typography_tokens']['lineHeight'],
-                'letterSpacing': current_results['typography_tokens']['letterSpacing']
-            },
+            'color': current_results['color_tokens'],
+            'spacing': {k: v for k, v in pattern_tokens.items() if k.startswith('spacing-')},
+            'grid': {k: v for k, v in pattern_tokens.items() if k.startswith('grid-')},
+            'typography': current_results['typography_tokens'],
             'metadata': {
-                **current_results['color_tokens']['metadata'],
+                'file_id': current_results['file_id'],
                 'generated_by': 'Tesserae v3.0 - Complete Design System Generator',
-                'features': ['color', 'spacing', 'sizing', 'typography', 'grid', 'accessibility']
+                'features': ['color', 'spacing', 'grid', 'typography']
             }
         }
         
-        return json.dumps(complete_tokens, indent=2)
+        # Write straight to a file for gr.File instead of rendering a large string
+        if orjson is not None:
+            with _new_export_file('wb', '.json') as f:
+                f.write(orjson.dumps(complete_tokens, option=orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_NUMPY))
+        else:
+            with _new_export_file('w', '.json') as f:
+                json.dump(complete_tokens, f, indent=2)
+        return f.name
     
-    def export_css():
-        """Export complete design tokens as CSS."""
+    def export_css(current_results):
+        """Export complete design tokens as a downloadable CSS file."""
         if current_results['color_tokens'] is None:
-            return "❌ No tokens to export. Process an image first."
+            raise gr.Error("No tokens to export. Process an image first.")
         
+        color_extractor, pattern_recognizer, typography_analyzer = _load_analyzers()
         color_css = color_extractor.export_css_variables(current_results['color_tokens'])
         pattern_css = pattern_recognizer.export_css_variables(current_results['pattern_tokens'])
         typography_css = typography_analyzer.export_css_variables(current_results['typography_tokens'])
         
-        # Combine
-        combined_css = "/* TESSERAE COMPLETE DESIGN SYSTEM */\n"
-        combined_css += "/* Generated from moodboard analysis */\n\n"
-        combined_css += "/* ==================== */\n"
-        combined_css += "/* COLOR TOKENS */\n"
-        combined_css += "/* ==================== */\n"
-        combined_css += color_css
-        combined_css += "\n\n/* ==================== */\n"
-        combined_css += "/* SPACING & LAYOUT */\n"
-        combined_css += "/* ==================== */\n"
-        combined_css += pattern_css
-        combined_css += "\n\n/* ==================== */\n"
-        combined_css += "/* TYPOGRAPHY */\n"
-        combined_css += "/* ==================== */\n"
-        combined_css += typography_css
-        
-        return combined_css
+        # Write each section straight to the download file
+        with _new_export_file('w', '.css') as f:
+            f.write("/* TESSERAE COMPLETE DESIGN SYSTEM */\n")
+            f.write("/* Generated from moodboard analysis */\n\n")
+            for i, (title, section_css) in enumerate([
+                ("COLOR TOKENS", color_css),
+                ("SPACING & LAYOUT", pattern_css),
+                ("TYPOGRAPHY", typography_css)
+            ]):
+                if i:
+                    f.write("\n\n")
+                f.write(f"/* ==================== */\n/* {title} */\n/* ==================== */\n")
+                f.write(section_css)
+        return f.name
     
     def check_expired_images():
         """Clean up expired images."""
@@ -300,6 +368,8 @@ def create_tesserae_interface():
         # ... rest of your UI code ...
    
         
+        results_state = gr.State(value=empty_results)
+        
         gr.Markdown("# 🎨 Tesserae - AI Design System Generator")
         gr.Markdown("*Extract complete design systems from moodboards: colors, spacing, typography, and more*")
         
@@ -362,11 +432,7 @@ def create_tesserae_interface():
                     gr.Markdown("### 📦 JSON Format")
                     gr.Markdown("*Complete design tokens - all systems combined*")
                     
-                    json_output = gr.Code(
-                        label="Design Tokens (JSON)",
-                        language="json",
-                        lines=30
-                    )
+                    json_output = gr.File(label="Design Tokens (JSON)")
                     
                     export_json_btn = gr.Button("📋 Generate JSON", variant="secondary")
                 
@@ -374,11 +440,7 @@ def create_tesserae_interface():
                     gr.Markdown("### 🎨 CSS Format")
                     gr.Markdown("*Production-ready CSS custom properties*")
                     
-                    css_output = gr.Code(
-                        label="CSS Custom Properties",
-                        language="css",
-                        lines=30
-                    )
+                    css_output = gr.File(label="CSS Custom Properties")
                     
                     export_css_btn = gr.Button("📋 Generate CSS", variant="secondary")
             
@@ -424,7 +486,7 @@ def create_tesserae_interface():
 ### Complete Feature Set
 
 ✅ **Color System**
-- K-means clustering for dominant color extraction
+- Quantized color histogram for dominant color extraction
 - Semantic naming and role detection
 - WCAG 2.1 accessibility compliance checking
 - Color harmony analysis
@@ -451,13 +513,12 @@ def create_tesserae_interface():
 ### Technical Implementation
 
 **Computer Vision:**
-- K-means clustering (n=8) for color extraction
+- 5-bit RGB histogram (top 8 bins) for color extraction
 - Canny edge detection for spacing/sizing
 - Contour analysis for pattern recognition
 - Text region detection for typography
 
 **AI & ML:**
-- Unsupervised learning for color clustering
 - Statistical analysis for pattern normalization
 - Heuristic algorithms for design token generation
 
@@ -483,7 +544,7 @@ def create_tesserae_interface():
 **Instructor:** Dan Bartlett  
 **Date:** October 2025
 
-**Built with:** Python, OpenCV, scikit-learn, Gradio  
+**Built with:** Python, OpenCV, NumPy, Gradio  
 
 ---
 
@@ -493,7 +554,7 @@ def create_tesserae_interface():
         # Connect event handlers
         upload_btn.click(
             fn=process_moodboard,
-            inputs=[image_input, consent_checkbox],
+            inputs=[image_input, consent_checkbox, results_state],
             outputs=[
                 status_output,
                 processed_image,
@@ -502,12 +563,13 @@ def create_tesserae_interface():
                 patterns_output,
                 typography_output,
                 analysis_output,
-                color_swatches
+                color_swatches,
+                results_state
             ]
         )
         
-        export_json_btn.click(fn=export_tokens_json, outputs=json_output)
-        export_css_btn.click(fn=export_css, outputs=css_output)
+        export_json_btn.click(fn=export_tokens_json, inputs=results_state, outputs=json_output)
+        export_css_btn.click(fn=export_css, inputs=results_state, outputs=css_output)
         cleanup_btn.click(fn=check_expired_images, outputs=cleanup_output)
     
     return demo
@@ -516,4 +578,11 @@ def create_tesserae_interface():
 def launch_tesserae_ui(share=False):
     """Launch the complete Tesserae interface."""
     demo = create_tesserae_interface()
+    
+    # Each analysis already fans out to three worker threads, so allow roughly one
+    # analysis per two cores; more concurrent jobs would only contend for CPU.
+    # Requests beyond that wait in the queue (up to 32) instead of being rejected.
+    # (Gradio 4 replaced queue(concurrency_count=...) with default_concurrency_limit.)
+    concurrency = max(2, (os.cpu_count() or 2) // 2)
+    demo.queue(default_concurrency_limit=concurrency, max_size=32)
     demo.launch(share=share, server_name="0.0.0.0", server_port=7860)